@@ -33,36 +33,68 @@ of the following:
 
 The above three items are true for seventeen individuals.  These are
 the players whose names are listed in the table that is output.
+
+Pages read from Baseball Reference are cached in bbref_cache.sqlite, so
+runs after the first one do not need to scrape the site again.  Schedules
+of past seasons and the pages of inactive players never change, so those
+pages never expire.  The player index pages are reread after thirty days.
 """
+import io
+import re
 import uuid
 import webbrowser
-import requests
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+import requests_cache
+from requests_cache import NEVER_EXPIRE
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+from selectolax.lexbor import LexborHTMLParser
+import numpy as np
 import pandas as pd
 HTML_PAGES = "https://www.baseball-reference.com"
 FIRST_MOVE = 1953
 LAST_MOVE = 1966
+SESSION = requests_cache.CachedSession(
+    "bbref_cache", backend="sqlite", expire_after=timedelta(days=30),
+    allowable_codes=(200, 404),
+    urls_expire_after={f"{HTML_PAGES}/teams/": NEVER_EXPIRE,
+                       f"{HTML_PAGES}/players/?/*.shtml": NEVER_EXPIRE})
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=1, pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.5,
+                      status_forcelist=[429, 502, 503, 504])))
+SESSION.headers.update({"User-Agent": "baseball_trivia",
+                        "Accept-Encoding": ACCEPT_ENCODING})
+MAX_WORKERS = 8
+PID_RE = re.compile(r'/([^/]+)\.shtml$')
+YEARS_RE = re.compile(r'\((\d{4})-(\d{4})\)')
 
-def pack_player(link, name, years):
+def career_years(years):
     """
-    Pack player information into a diictionary
+    Extract the first and last years of a player's career
 
     Input:
-        link: partial url of this player's page
-        name: player's name
         years: career years formatted as "(xxxx-yyyy)"
 
     Returns:
-        A dictionary containing the link, name, first and last year values
-        to be added to the value passed back  from scan_inactive_players.
+        A tuple of the integer first and last years of the career
+    """
+    yrmatch = YEARS_RE.search(years)
+    return int(yrmatch.group(1)), int(yrmatch.group(2))
+
+def get_page(urlv):
     """
-    retv = {}
-    retv["link"] = link
-    retv["name"] = name
-    syears = years.strip().split("-")
-    retv["first"] = int(syears[0].split("(")[-1])
-    retv["last"] = int(syears[1].split(")")[0])
-    return retv
+    Fetch a page from Baseball Reference using the shared session
+
+    Input:
+        urlv -- url of the page to be read
+
+    Return:
+        The response object for this page
+    """
+    return SESSION.get(urlv, timeout=30)
 
 def pl_id(plindex):
     """
@@ -74,9 +106,7 @@ def pl_id(plindex):
     Return:
         Seven character player id string used by Baseball Reference
     """
-    splt1 = plindex.split("/")[-1]
-    splt2 = splt1.split(".")[0]
-    return splt2
+    return PID_RE.search(plindex).group(1)
 
 def scan_inactive_players():
     """
@@ -90,41 +120,61 @@ def scan_inactive_players():
     years, so this flaw in the parsing does not affect the results of the
     old pitcher search.
 
-    This routine returns a dictionary indexed by the Baseball Reference
-    player id.  Each entry is a dictionary consisting of four named values:
-        link: a link to the url of the player's page
-        name: the name of the player
+    This routine returns a dictionary of parallel numpy arrays, with one
+    element per player in each array (a player listed more than once in
+    the index is only kept once):
+        ids: the Baseball Reference player id
+        links: a link to the url of the player's page
+        names: the name of the player
         first: integer value of the year this player's career started
         last: integer value of the last year of this player's career
     """
-    retv = {}
-    for flet in "abcdefghijklmnopqrstuvwxyz":
-        apage = f"{HTML_PAGES}/players/{flet}"
-        resp = requests.get(apage)
-        soup = BeautifulSoup(resp.text, "html.parser")
-        info = soup.find_all("p")
-        for entry in info:
-            if len(entry.contents) < 2:
-                continue
-            plyr_ref = entry.find(href=True)
-            if plyr_ref is None:
+    seen = set()
+    ids = []
+    names = []
+    links = []
+    firsts = []
+    lasts = []
+    apages = [f"{HTML_PAGES}/players/{flet}"
+              for flet in "abcdefghijklmnopqrstuvwxyz"]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        responses = list(pool.map(get_page, apages))
+    for resp in responses:
+        tree = LexborHTMLParser(resp.content)
+        for entry in tree.css("p"):
+            plyr_ref = entry.child
+            if plyr_ref is None or plyr_ref.tag != "a":
                 continue
-            try:
-                hrefv =  entry.contents[0]['href']
-            except TypeError:
+            years = plyr_ref.next
+            if years is None:
                 continue
+            hrefv = plyr_ref.attributes.get("href") or ""
             if not hrefv.startswith("/players/"):
                 continue
             if not hrefv.endswith(".shtml"):
                 continue
-            ppacket = pack_player(hrefv, plyr_ref.contents[0],
-                                  entry.contents[1])
-            retv[pl_id(hrefv)] = ppacket
-    return retv
+            br_id = pl_id(hrefv)
+            if br_id in seen:
+                continue
+            seen.add(br_id)
+            first, last = career_years(years.text())
+            ids.append(br_id)
+            names.append(plyr_ref.text())
+            links.append(hrefv)
+            firsts.append(first)
+            lasts.append(last)
+    return {"ids": np.array(ids, dtype=object),
+            "names": np.array(names, dtype=object),
+            "links": np.array(links, dtype=object),
+            "first": np.fromiter(firsts, dtype=np.int16),
+            "last": np.fromiter(lasts, dtype=np.int16)}
 
 def not_a_pit(br_id):
     """
-    Test used to weed out non-pitchers from the list of players to check
+    Test used to weed out non-pitchers from the list of players to check.
+    The player index pages do not list positions, so the player's own
+    page is read instead.  Only inactive players get here, so the page
+    stays in the cache once it has been read.
 
     Input:
         br_id -- Baseball Reference player id:
@@ -133,74 +183,99 @@ def not_a_pit(br_id):
     """
     initl = br_id[0]
     urlv = f"{HTML_PAGES}/players/{initl}/{br_id}.shtml"
-    resp = requests.get(urlv)
-    if resp.text.find("Standard Pitching") < 0:
-        return True
-    return False
+    resp = get_page(urlv)
+    return b"Standard Pitching" not in resp.content
 
 def find_p_in_right_time_period():
     """
     Look through all the players.  Return only those players that
     are pitchers who have played in the right time periods (before 1953
-    and after 1965).
+    and after 1965).  The players are returned in the same parallel array
+    format used by scan_inactive_players.
     """
-    retpit = {}
     pl_data = scan_inactive_players()
-    for entry in pl_data.items():
-        indp = entry[1]
-        if indp['first'] >= FIRST_MOVE:
-            continue
-        if indp['last'] < LAST_MOVE:
-            continue
-        if not_a_pit(entry[0]):
-            continue
-        retpit[entry[0]] = pl_data[entry[0]]
-    return retpit
+    mask = (pl_data["first"] < FIRST_MOVE) & (pl_data["last"] >= LAST_MOVE)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        non_pitchers = np.fromiter(pool.map(not_a_pit, pl_data["ids"][mask]),
+                                   dtype=bool)
+    mask[mask] = ~non_pitchers
+    return {key: column[mask] for key, column in pl_data.items()}
 
 def get_team_game_table(yearv, tabbrev):
     """
     Given a year and a team abbreviation (BSN for Boston, MLN for Milwaukee,
     and ATL for Atlanta), find the web page for that team's schedule and
-    return the results table.
+    return the results table.  The table is returned as a DataFrame whose
+    cells are (text, link) tuples.
     """
     web_page = f"{HTML_PAGES}/teams/{tabbrev}/{yearv}"
     web_page += "-schedule-scores.shtml"
-    resp = requests.get(web_page)
-    soup = BeautifulSoup(resp.text, "html.parser")
-    tablev = soup.find('table', id="team_schedule")
-    return tablev
+    resp = get_page(web_page)
+    tables = pd.read_html(io.BytesIO(resp.content),
+                          attrs={"id": "team_schedule"}, extract_links="body")
+    return tables[0]
 
-def check_range(checker_list, yranges):
+def active_pitchers(pitchers, careers, yearv):
+    """
+    Find the pitchers in a group whose careers include a given year
+
+    Input:
+        pitchers: player id's of the pitchers to check
+        careers: dictionary of (first, last) career years indexed by
+                 player id
+        yearv: year to check
+
+    Returns:
+        List of player id's of the pitchers active in that year
+    """
+    return [pid for pid in pitchers
+            if careers[pid][0] <= yearv <= careers[pid][1]]
+
+def check_range(checker_set, yranges, careers):
     """
     Find pitcher wins by scanning all possible Braves games in a time period
 
     Input:
-        checker_list: List of player id's of eligible pitchers
+        checker_set: Set of player id's of eligible pitchers
         yranges: list of lists.  Each list entry at the top level represents
                  a city.  Each entry in that list contains the first and
                  last years that need to be checked in order to find
                  pitchers who have beaten the Braves in a specific city
+        careers: dictionary of (first, last) career years indexed by
+                 player id
 
     Returns:
         dictionary indexed by player ids.  The data inside those player
         ids is a list of cities that that player has had wins against.
+        Each city appears once.  A schedule page is skipped if every
+        pitcher active that year already has a win against that city,
+        so the number of wins against a city is not known.
     """
-    answer = {}
-    for entry in checker_list:
-        answer[entry] = []
+    answer = {entry: [] for entry in checker_set}
     tabbrev = ['BSN', 'MLN', 'ATL']
-    for count, rngvals in enumerate(yranges):
-        for yearv in range(rngvals[0], rngvals[1]):
-            tablev = get_team_game_table(yearv, tabbrev[count])
-            for row in tablev.tbody.find_all('tr'):
-                columns = row.find_all('td')
-                if len(columns) < 12:
-                    continue
-                if columns[5].text.startswith("L"):
-                    plyrw = columns[12].find('a')['href'].split("/")[-1]
-                    pname = plyrw.split('.')[0]
-                    if pname in checker_list:
-                        answer[pname].append(tabbrev[count])
+    needed = {team: set(checker_set) for team in tabbrev}
+    jobs = [(tabbrev[count], yearv) for count, rngvals in enumerate(yranges)
+            for yearv in range(rngvals[0], rngvals[1])]
+    jobs.sort(key=lambda job: -len(active_pitchers(checker_set, careers,
+                                                   job[1])))
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        pending = {pool.submit(get_team_game_table, yearv, team):
+                   (team, yearv) for team, yearv in jobs}
+        for future in as_completed(list(pending)):
+            team = pending.pop(future)[0]
+            if future.cancelled():
+                continue
+            games = future.result()
+            lost = games["W/L"].str[0].str.startswith("L", na=False)
+            links = games["Win"][lost].str[1]
+            winners = links.str.extract(PID_RE, expand=False)
+            for pname in set(winners[winners.isin(needed[team])]):
+                answer[pname].append(team)
+                needed[team].discard(pname)
+            for other, (oteam, oyear) in pending.items():
+                if oteam == team and not active_pitchers(needed[team],
+                                                         careers, oyear):
+                    other.cancel()
     return answer
 
 def html_display(answer, pdata):
@@ -210,25 +285,20 @@ def html_display(answer, pdata):
     Input:
         answer: Results collected by the rest of the code in
         the_search_for_all_three
-        pdata: Table of players.  Used to get player's name into the table.
+        pdata: Arrays of player data.  Used to get player's name into the
+        table.
 
     Creates a local file that gets displayed on the browser.  Results
     are formatted into an html table whose columns are pitcher names
     and the teams they have beaten.
     """
     full_name = {"BSN": "Boston", "MLN": "Milwaukee", "ATL": "Atlanta"}
-    output = {"Pitcher": [], "Opponents": []}
-    for pit in answer.items():
-        abbrev_list = list(set(pit[1]))
-        city_list = []
-        for entry in abbrev_list:
-            city_list.append(full_name[entry])
-        olist = ', '.join(city_list)
-        if not olist:
-            olist = "None"
-        output["Pitcher"].append(pdata[pit[0]]['name'])
-        output["Opponents"].append(olist)
-    dframe = pd.DataFrame.from_dict(output)
+    dframe = pd.DataFrame(
+        [(name,
+          ', '.join(sorted({full_name[abbrev] for abbrev in answer[pid]}))
+          or "None")
+         for pid, name in zip(pdata["ids"], pdata["names"])],
+        columns=["Pitcher", "Opponents"])
     uniq_id = str(uuid.uuid4())
     ufname = f"pitchers-{uniq_id}.html"
     with open(ufname, 'w', encoding="utf8") as fdout:
@@ -245,18 +315,15 @@ def the_search_for_all_three():
     the Braves.
     """
     pdata = find_p_in_right_time_period()
-    checker_list =  list(pdata.keys())
-    earliest = FIRST_MOVE - 1
-    latest = LAST_MOVE
-    for entry in pdata.items():
-        if entry[1]['first'] < earliest:
-            earliest = entry[1]['first']
-        if entry[1]['last'] > latest:
-            latest = entry[1]['last']
+    checker_set = set(pdata["ids"])
+    earliest = int(np.min(pdata["first"], initial=FIRST_MOVE - 1))
+    latest = int(np.max(pdata["last"], initial=LAST_MOVE))
     yranges = [[earliest, FIRST_MOVE],
                [FIRST_MOVE, LAST_MOVE],
                [LAST_MOVE, latest + 1]]
-    answer = check_range(checker_list, yranges)
+    careers = dict(zip(pdata["ids"], zip(pdata["first"].tolist(),
+                                         pdata["last"].tolist())))
+    answer = check_range(checker_set, yranges, careers)
     html_display(answer, pdata)
 
 if __name__ == "__main__":